@@ -0,0 +1 @@
+# Lets pytest import the backend packages (models, node, utils, workflow) the same way main.py does.
@@ -10,6 +10,7 @@ from models.model import (
     EmailRequest
 )
 from workflow.agent import Agent
+from utils.session_trace import SessionTrace
 
 app = FastAPI(title="Travel Agent API")
 
@@ -23,7 +24,7 @@ app.add_middleware(
 )
 
 # Initialize agent as a global variable
-agent = Agent()
+agent = Agent(trace=SessionTrace.from_env())
 
 @app.get("/")
 async def root():
@@ -38,7 +39,7 @@ async def process_travel_query(query: TravelQuery):
         messages = [{"role": "user", "content": query.query}]
         config = {'configurable': {'thread_id': thread_id}}
         
-        result = agent.graph.invoke({'messages': messages}, config=config)
+        result = agent.invoke({'messages': messages}, config=config)
         
         return {
             "thread_id": thread_id,
@@ -102,7 +103,7 @@ async def send_email(request: EmailRequest):
             }
         }
         
-        agent.graph.invoke({'content': request.content}, config=config)
+        agent.invoke({'content': request.content}, config=config)
         return {"status": "success", "message": "Email sent successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
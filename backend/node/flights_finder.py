@@ -1,10 +1,10 @@
 from langchain_core.tools import tool
 from datetime import datetime
-import serpapi
 import os
 
 from models.model import FlightsInputSchema, FlightsInput
 from utils.flights_find import parse_flight_results
+from utils.session_trace import TraceMismatchError, serpapi_search
 
 @tool(args_schema=FlightsInputSchema)
 def flights_finder(params: FlightsInput):
@@ -33,8 +33,9 @@ def flights_finder(params: FlightsInput):
     }
 
     try:
-        search = serpapi.search(params)
-        results = search.data['best_flights']
+        results = serpapi_search('flights_finder', params)['best_flights']
+    except TraceMismatchError:
+        raise
     except Exception as e:
         results = str(e)
     return results
\ No newline at end of file
@@ -1,9 +1,9 @@
 from langchain_core.tools import tool
-import serpapi
 import os
 
 from models.model import HotelsInputSchema, HotelsInput
 from utils.hotel_find import parse_hotel_results
+from utils.session_trace import serpapi_search
 
 @tool(args_schema=HotelsInputSchema)
 def hotels_finder(params: HotelsInput):
@@ -30,6 +30,5 @@ def hotels_finder(params: HotelsInput):
         'hotel_class': params.hotel_class
     }
 
-    search = serpapi.search(params)
-    results = search.data
+    results = serpapi_search('hotels_finder', params)
     return results['properties'][:5]
@@ -0,0 +1,111 @@
+'''
+Replay a recorded session trace through the Agent graph without network access.
+
+Record a trace by starting the API with FLIGHTPY_TRACE_MODE=record and FLIGHTPY_TRACE_FILE=<path>,
+then replay it, optionally under a profiler:
+
+    python replay.py session.jsonl
+    python replay.py session.jsonl --profiler cprofile --output session.prof
+    python replay.py session.jsonl --profiler pyinstrument --output flamegraph.html
+'''
+import argparse
+import cProfile
+import pstats
+import sys
+
+from utils.session_trace import SessionTrace, TraceMismatchError
+from workflow.agent import Agent
+
+
+def replay_runs(trace: SessionTrace, repeat: int = 1):
+    '''Re-run every recorded graph run, raising TraceMismatchError if the graph diverges from the trace.'''
+    for _ in range(repeat):
+        agent = Agent(trace=trace)  # fresh checkpointer, recorded thread ids start empty again
+        for run in trace.runs:
+            trace.replay_run(agent.graph, run)
+
+
+def profile_cprofile(fn, output: str = None):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        fn()
+    finally:
+        profiler.disable()
+    if output:
+        profiler.dump_stats(output)  # open with snakeviz or flameprof for a flamegraph
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+def profile_pyinstrument(fn, output: str = None):
+    try:
+        from pyinstrument import Profiler
+        from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+    except ImportError:
+        sys.exit('pyinstrument is not installed, run: pip install pyinstrument')
+
+    profiler = Profiler()
+    profiler.start()
+    try:
+        fn()
+    finally:
+        profiler.stop()
+    if output:
+        # .html opens in a browser, anything else is written as a speedscope.app flamegraph
+        renderer = HTMLRenderer() if output.endswith('.html') else SpeedscopeRenderer()
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(profiler.output(renderer))
+    print(profiler.output_text(unicode=True, color=False))
+
+
+PROFILERS = {
+    'cprofile': profile_cprofile,
+    'pyinstrument': profile_pyinstrument,
+}
+
+
+def print_timings(trace: SessionTrace, repeat: int = 1):
+    '''Compare per-call node times; replayed calls are counted per pass.'''
+    print(f'{"node":<16}{"recorded calls":>16}{"mean (ms)":>12}{"replayed calls":>16}{"mean (ms)":>12}')
+    for name in sorted(set(trace.recorded_timings) | set(trace.timings)):
+        recorded = trace.recorded_timings.get(name, [])
+        replayed = trace.timings.get(name, [])
+        recorded_mean = 1000 * sum(recorded) / len(recorded) if recorded else 0.0
+        replayed_mean = 1000 * sum(replayed) / len(replayed) if replayed else 0.0
+        print(f'{name:<16}{len(recorded):>16}{recorded_mean:>12.2f}{len(replayed) // repeat:>16}{replayed_mean:>12.2f}')
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be a positive integer, got {value}')
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded Agent session trace.')
+    parser.add_argument('trace', help='JSONL trace file written with FLIGHTPY_TRACE_MODE=record')
+    parser.add_argument('--profiler', choices=sorted(PROFILERS), help='Profile the replay')
+    parser.add_argument('--output', help='Where to write the profile (.prof, .html or speedscope .json)')
+    parser.add_argument('--repeat', type=positive_int, default=1, help='Replay the trace this many times')
+    args = parser.parse_args()
+
+    trace = SessionTrace(args.trace, 'replay')
+    print(f'Replaying {len(trace.runs)} run(s) from {args.trace}')
+
+    def replay():
+        replay_runs(trace, repeat=args.repeat)
+
+    try:
+        if args.profiler:
+            PROFILERS[args.profiler](replay, args.output)
+        else:
+            replay()
+    except TraceMismatchError as e:
+        sys.exit(f'Replay diverged from the trace: {e}')
+
+    print_timings(trace, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+import workflow.agent
+from utils import session_trace
+from utils.session_trace import SessionTrace, TraceMismatchError
+from workflow.agent import Agent
+
+FLIGHT_ARGS = {'params': {
+    'departure_airport': 'MAD', 'arrival_airport': 'AMS',
+    'outbound_date': '2025-10-01', 'return_date': '2025-10-07',
+}}
+
+
+def flights_call(call_id):
+    return AIMessage(content='', tool_calls=[{'name': 'flights_finder', 'args': FLIGHT_ARGS, 'id': call_id}])
+
+
+class StubChatModel:
+    '''Stands in for ChatOpenAI, answering from a shared script of responses.'''
+
+    script = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        response = self.script.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class StubSearch:
+
+    def __init__(self, data):
+        self.data = data
+
+
+def query(text, thread_id):
+    return {'messages': [{'role': 'user', 'content': text}]}, {'configurable': {'thread_id': thread_id}}
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    monkeypatch.setenv('SERPAPI_API_KEY', 'secret-key')
+    monkeypatch.setattr(workflow.agent, 'ChatOpenAI', StubChatModel)
+    monkeypatch.setattr(session_trace.serpapi, 'search',
+                        lambda params: StubSearch({'best_flights': [{'price': 120, 'to': params['arrival_id']}]}))
+    yield
+    StubChatModel.script = []
+
+
+def go_offline(monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError('replay must not reach OpenAI or SerpAPI')
+
+    monkeypatch.setattr(workflow.agent, 'ChatOpenAI', no_network)
+    monkeypatch.setattr(session_trace.serpapi, 'search', no_network)
+
+
+def record(path, script, runs):
+    StubChatModel.script = list(script)
+    agent = Agent(trace=SessionTrace(path, 'record'))
+    results = []
+    for inputs, config in runs:
+        try:
+            results.append(agent.invoke(inputs, config))
+        except Exception as e:
+            results.append(e)
+    return agent, results
+
+
+def test_round_trip(tmp_path, stubs, monkeypatch):
+    path = str(tmp_path / 'session.jsonl')
+    agent, results = record(path, [flights_call('c1'), AIMessage(content='Found flights')], [query('Madrid to Amsterdam', 't1')])
+    # A direct search between runs, as the /search/flights endpoint does, must not end up in the trace
+    agent._tools['flights_finder'].invoke(FLIGHT_ARGS)
+    StubChatModel.script = [flights_call('c2'), AIMessage(content='Found more flights')]
+    agent.invoke(*query('And once more', 't2'))
+
+    with open(path) as f:
+        text = f.read()
+    assert 'secret-key' not in text
+    events = [json.loads(line) for line in text.splitlines()]
+    run_ids = {e['run'] for e in events if e['type'] == 'run'}
+    assert {e['type'] for e in events} == {'run', 'llm', 'tool', 'node'}
+    assert len(run_ids) == 2
+    assert [e['type'] for e in events].count('tool') == 2
+    assert all(e['run'] in run_ids for e in events)
+
+    go_offline(monkeypatch)
+    trace = SessionTrace(path, 'replay')
+    assert len(trace.runs) == 2
+    replayed = [trace.replay_run(Agent(trace=trace).graph, run) for run in trace.runs]
+    assert replayed[0]['messages'][-1].content == results[0]['messages'][-1].content
+    assert replayed[1]['messages'][-1].content == 'Found more flights'
+    assert len(trace.timings['invoke_tools']) == len(trace.recorded_timings['invoke_tools']) == 2
+
+
+def test_divergence(tmp_path, stubs):
+    path = str(tmp_path / 'session.jsonl')
+    record(path, [flights_call('c1'), AIMessage(content='Found flights')], [query('Madrid to Amsterdam', 't1')])
+
+    trace = SessionTrace(path, 'replay')
+    run = trace.runs[0]
+    with pytest.raises(TraceMismatchError, match='tools_llm was called with different messages'):
+        trace.replay_run(Agent(trace=trace).graph, dict(run, inputs=query('Paris to Rome', 't1')[0]))
+
+    # The flights_finder error handler must not swallow a divergence in the tool params
+    for event in run['events']:
+        if event['type'] == 'tool':
+            event['params']['arrival_id'] = 'LHR'
+    with pytest.raises(TraceMismatchError, match='flights_finder called with'):
+        trace.replay_run(Agent(trace=trace).graph, run)
+
+
+def test_error_replay(tmp_path, stubs, monkeypatch):
+    path = str(tmp_path / 'session.jsonl')
+    StubChatModel.script = [RuntimeError('Rate limit reached'), AIMessage(content='Sorry, try later')]
+    agent = Agent(trace=SessionTrace(path, 'record'))
+
+    with pytest.raises(RuntimeError):
+        agent.invoke(*query('Madrid to Amsterdam', 't1'))
+    agent.invoke(*query('Madrid to Amsterdam', 't2'))
+
+    go_offline(monkeypatch)
+    trace = SessionTrace(path, 'replay')
+    graph = Agent(trace=trace).graph
+    assert trace.replay_run(graph, trace.runs[0]) is None
+    assert trace.replay_run(graph, trace.runs[1])['messages'][-1].content == 'Sorry, try later'
+
+
+def test_from_env_rejects_replay(monkeypatch):
+    monkeypatch.setenv('FLIGHTPY_TRACE_MODE', 'replay')
+    monkeypatch.setenv('FLIGHTPY_TRACE_FILE', 'session.jsonl')
+    with pytest.raises(ValueError, match='replay.py'):
+        SessionTrace.from_env()
@@ -0,0 +1,337 @@
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import serpapi
+from langchain_core.messages import message_to_dict, messages_from_dict, messages_to_dict
+
+TRACE_MODE_ENV = 'FLIGHTPY_TRACE_MODE'
+TRACE_FILE_ENV = 'FLIGHTPY_TRACE_FILE'
+TRACE_MODES = ('off', 'record', 'replay')
+
+_current_run = contextvars.ContextVar('flightpy_trace_run', default=None)
+
+
+class TraceMismatchError(Exception):
+    '''Raised when a replayed run diverges from the recorded trace.'''
+
+
+class ReplayedError(Exception):
+    '''Re-raises an LLM or tool failure that was captured while recording.'''
+
+
+def _normalize(value):
+    # Round-trip through JSON so live values compare equal to the ones read back from the trace
+    return json.loads(json.dumps(value, default=str))
+
+
+def _digest(messages: list) -> str:
+    # Message ids are random per run, so hash only what the model actually sees.
+    # Tool results are plain strings, so large SerpAPI payloads are hashed without re-serializing them.
+    h = hashlib.blake2b(digest_size=16)
+    for m in messages:
+        content = m.content if isinstance(m.content, str) else json.dumps(m.content, sort_keys=True, default=str)
+        calls = json.dumps([(c['name'], c['args']) for c in getattr(m, 'tool_calls', None) or []],
+                           sort_keys=True, default=str)
+        for part in (m.type, content, calls):
+            h.update(part.encode())
+            h.update(b'\0')
+    return h.hexdigest()
+
+
+class _Run:
+    '''
+    State of the graph run in progress: events buffered while recording, or the recorded
+    calls still to be answered while replaying.
+    '''
+
+    def __init__(self, trace: 'SessionTrace', run_id: str, events: list = ()):
+        self.trace = trace
+        self.id = run_id
+        self.events = []
+        self.timings = defaultdict(list)
+        self._calls = defaultdict(deque)
+        for event in events:
+            if event['type'] != 'node':
+                self._calls[event['type'], event['name']].append(event)
+
+    def next(self, kind: str, name: str) -> dict:
+        try:
+            return self._calls[kind, name].popleft()
+        except IndexError:
+            raise TraceMismatchError(f'No recorded {kind} call left for {name!r} in run {self.id}') from None
+
+    def pending(self) -> int:
+        return sum(len(calls) for calls in self._calls.values())
+
+
+class SessionTrace:
+    '''
+    Records or replays the external calls made while running the Agent graph.
+
+    Modes:
+        off: calls go straight to OpenAI and SerpAPI, nothing is written.
+        record: each graph run is appended to a JSONL trace file when it ends, together with the
+            node timings, LLM calls and tool calls made during it. Calls made outside a graph run,
+            such as the direct search endpoints, are not recorded.
+        replay: LLM and tool calls are answered from the trace file, so the graph runs without network access.
+            Only runs started through replay_run are replayed, see replay.py.
+    '''
+
+    def __init__(self, path: str = None, mode: str = 'off'):
+        if mode not in TRACE_MODES:
+            raise ValueError(f'Unknown trace mode {mode!r}, expected one of {TRACE_MODES}')
+        if mode != 'off' and not path:
+            raise ValueError(f'Trace mode {mode!r} requires a trace file')
+
+        self.path = path
+        self.mode = mode
+        self.runs = []
+        self.recorded_timings = defaultdict(list)
+        self.timings = defaultdict(list)
+        self._lock = threading.Lock()
+
+        if self.replaying:
+            self._load()
+
+    @classmethod
+    def from_env(cls):
+        mode = os.environ.get(TRACE_MODE_ENV, 'off')
+        if mode == 'replay':
+            raise ValueError(f'{TRACE_MODE_ENV}=replay is not supported by the API server, '
+                             'replay a trace with: python replay.py <trace file>')
+        return cls(os.environ.get(TRACE_FILE_ENV), mode)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    def _current(self):
+        # Only runs started by this trace count, so a graph built on another trace is never mixed in
+        run = _current_run.get()
+        if run is not None and run.trace is not self:
+            run = None
+        if run is None and self.replaying:
+            raise TraceMismatchError('Call made outside a replayed run')
+        return run
+
+    def _flush(self, run: _Run, event: dict):
+        # Serializing happens here, after the run, so it does not count towards the node timings
+        lines = []
+        for e in run.events + [event]:
+            if e['type'] == 'llm':
+                e = dict(e, request=messages_to_dict(e['request']))
+                if 'response' in e:
+                    e['response'] = message_to_dict(e['response'])
+            lines.append(json.dumps(dict(e, run=run.id), default=str) + '\n')
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def _load(self):
+        events = defaultdict(list)
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event['type'] == 'run':
+                    self.runs.append(event)
+                else:
+                    events[event['run']].append(event)
+                    if event['type'] == 'node':
+                        self.recorded_timings[event['name']].append(event['duration'])
+        # Digests of the recorded messages are computed once here, not on every replayed call
+        for run in self.runs:
+            run['events'] = events[run['run']]
+            run['digest'] = _digest(messages_from_dict(run.get('output', [])))
+            for event in run['events']:
+                if event['type'] == 'llm':
+                    event['digest'] = _digest(messages_from_dict(event['request']))
+
+    def llm(self, name: str, factory):
+        '''
+        Build the chat model called ``name``, wrapped for the current mode.
+
+        Args:
+            name: Key used to match calls between recording and replay.
+            factory: Zero-argument callable returning the real model; not called when replaying.
+        '''
+        if self.replaying:
+            return _ReplayLLM(self, name)
+        llm = factory()
+        if self.recording:
+            return _RecordingLLM(self, name, llm)
+        return llm
+
+    def tool_call(self, name: str, params: dict, call):
+        '''
+        Run ``call`` for the tool ``name``, or return its recorded payload when replaying.
+
+        The ``api_key`` entry of ``params`` is never written to the trace.
+        '''
+        run = self._current()
+        if run is None:
+            return call()
+
+        params = _normalize({k: v for k, v in params.items() if k != 'api_key'})
+
+        if self.replaying:
+            event = run.next('tool', name)
+            if params != event['params']:
+                raise TraceMismatchError(f'{name} called with {params}, trace has {event["params"]}')
+            if 'error' in event:
+                raise ReplayedError(event['error'])
+            return event['payload']
+
+        event = {'type': 'tool', 'name': name, 'params': params, 'ts': time.time()}
+        start = time.perf_counter()
+        try:
+            event['payload'] = call()
+        except Exception as e:
+            event['error'] = str(e)
+            raise
+        finally:
+            event['duration'] = time.perf_counter() - start
+            run.events.append(event)
+        return event['payload']
+
+    def node(self, name: str, fn):
+        '''Wrap the graph node ``fn`` so its wall time is recorded, or collected when replaying.'''
+        if self.mode == 'off':
+            return fn
+
+        @functools.wraps(fn)
+        def timed(state):
+            run = _current_run.get()
+            if run is not None and run.trace is not self:
+                run = None
+            start = time.perf_counter()
+            try:
+                return fn(state)
+            finally:
+                duration = time.perf_counter() - start
+                if run is not None and self.recording:
+                    run.events.append({'type': 'node', 'name': name, 'duration': duration, 'ts': time.time()})
+                elif run is not None:
+                    run.timings[name].append(duration)
+
+        return timed
+
+    def run(self, graph, inputs: dict, config: dict):
+        '''Invoke ``graph`` and, when recording, store the run with every call made during it.'''
+        if not self.recording:
+            return graph.invoke(inputs, config=config)
+
+        run = _Run(self, uuid.uuid4().hex)
+        event = {'type': 'run', 'inputs': _normalize(inputs), 'config': _normalize(config), 'ts': time.time()}
+        token = _current_run.set(run)
+        start = time.perf_counter()
+        try:
+            result = graph.invoke(inputs, config=config)
+            event['output'] = messages_to_dict(result.get('messages', []))
+            return result
+        except Exception as e:
+            event['error'] = str(e)
+            raise
+        finally:
+            event['duration'] = time.perf_counter() - start
+            _current_run.reset(token)
+            self._flush(run, event)
+
+    def replay_run(self, graph, run: dict):
+        '''
+        Re-run the recorded ``run`` on ``graph``, answering its calls from the trace.
+
+        Raises:
+            TraceMismatchError: If the graph makes different calls, ends with different messages
+                or fails differently than it did while recording.
+        '''
+        state = _Run(self, run['run'], run['events'])
+        token = _current_run.set(state)
+        try:
+            result = graph.invoke(run['inputs'], config=run['config'])
+        except TraceMismatchError:
+            raise
+        except Exception as e:
+            if str(e) != run.get('error'):
+                raise TraceMismatchError(f'Run {state.id} failed with {e!r}, trace has {run.get("error")!r}') from e
+            result = None
+        finally:
+            _current_run.reset(token)
+            for name, durations in state.timings.items():
+                self.timings[name].extend(durations)
+
+        if result is not None:
+            if 'error' in run:
+                raise TraceMismatchError(f'Run {state.id} succeeded, trace has {run["error"]!r}')
+            if _digest(result.get('messages', [])) != run['digest']:
+                raise TraceMismatchError(f'Run {state.id} produced different messages than the trace')
+        if state.pending():
+            raise TraceMismatchError(f'Run {state.id} left {state.pending()} recorded call(s) unused')
+        return result
+
+
+class _RecordingLLM:
+
+    def __init__(self, trace: SessionTrace, name: str, llm):
+        self._trace = trace
+        self._name = name
+        self._llm = llm
+
+    def invoke(self, messages: list):
+        run = self._trace._current()
+        if run is None:
+            return self._llm.invoke(messages)
+
+        event = {'type': 'llm', 'name': self._name, 'request': list(messages), 'ts': time.time()}
+        start = time.perf_counter()
+        try:
+            event['response'] = self._llm.invoke(messages)
+        except Exception as e:
+            event['error'] = str(e)
+            raise
+        finally:
+            event['duration'] = time.perf_counter() - start
+            run.events.append(event)
+        return event['response']
+
+
+class _ReplayLLM:
+
+    def __init__(self, trace: SessionTrace, name: str):
+        self._trace = trace
+        self._name = name
+
+    def invoke(self, messages: list):
+        event = self._trace._current().next('llm', self._name)
+        if _digest(messages) != event['digest']:
+            raise TraceMismatchError(f'{self._name} was called with different messages than the trace')
+        if 'error' in event:
+            raise ReplayedError(event['error'])
+        return messages_from_dict([event['response']])[0]
+
+
+def serpapi_search(tool_name: str, params: dict) -> dict:
+    '''
+    Run a SerpAPI search through the trace of the graph run in progress, if any.
+
+    Returns:
+        dict: Raw SerpAPI response data.
+    '''
+    def call():
+        return serpapi.search(params).data
+
+    run = _current_run.get()
+    if run is None:
+        return call()
+    return run.trace.tool_call(tool_name, params, call)
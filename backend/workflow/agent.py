@@ -1,3 +1,6 @@
+import os
+
+from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
@@ -9,22 +12,26 @@ from langgraph.graph import MessagesState
 from prompt.prompt import EMAILS_SYSTEM_PROMPT, TOOLS_SYSTEM_PROMPT
 from node.flights_finder import flights_finder
 from node.hotels_finder import hotels_finder
+from utils.session_trace import SessionTrace
 
 TOOLS = [flights_finder, hotels_finder]
 
 load_dotenv()
-os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
+if os.getenv('OPENAI_API_KEY'):  # not needed when replaying a trace
+    os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 
 class Agent:
 
-    def __init__(self):
+    def __init__(self, trace: SessionTrace = None):
+        self._trace = trace or SessionTrace()
         self._tools = {t.name: t for t in TOOLS}
-        self._tools_llm = ChatOpenAI(model='gpt-4o').bind_tools(TOOLS)
+        self._tools_llm = self._trace.llm('tools_llm', lambda: ChatOpenAI(model='gpt-4o').bind_tools(TOOLS))
+        self._email_llm = self._trace.llm('email_llm', lambda: ChatOpenAI(model='gpt-4o', temperature=0.1))
 
         builder = StateGraph(MessagesState)
-        builder.add_node('call_tools_llm', self.call_tools_llm)
-        builder.add_node('invoke_tools', self.invoke_tools)
-        builder.add_node('email_sender', self.email_sender)
+        builder.add_node('call_tools_llm', self._trace.node('call_tools_llm', self.call_tools_llm))
+        builder.add_node('invoke_tools', self._trace.node('invoke_tools', self.invoke_tools))
+        builder.add_node('email_sender', self._trace.node('email_sender', self.email_sender))
         builder.set_entry_point('call_tools_llm')
 
         builder.add_conditional_edges('call_tools_llm', Agent.exists_action, {'more_tools': 'invoke_tools', 'email_sender': 'email_sender'})
@@ -35,6 +42,9 @@ class Agent:
 
         print(self.graph.get_graph().draw_mermaid())
 
+    def invoke(self, inputs: dict, config: dict):
+        return self._trace.run(self.graph, inputs, config)
+
     @staticmethod
     def exists_action(state: MessagesState):
         result = state['messages'][-1]
@@ -44,10 +54,12 @@ class Agent:
 
     def email_sender(self, state: MessagesState):
         print('Sending email')
-        email_llm = ChatOpenAI(model='gpt-4o', temperature=0.1)  # Instantiate another LLM
         email_message = [SystemMessage(content=EMAILS_SYSTEM_PROMPT), HumanMessage(content=state['messages'][-1].content)]
-        email_response = email_llm.invoke(email_message)
+        email_response = self._email_llm.invoke(email_message)
         print('Email content:', email_response.content)
+        if self._trace.replaying:
+            print('Replaying trace, email not sent')
+            return
 
         message = Mail(from_email=os.environ['FROM_EMAIL'], to_emails=os.environ['TO_EMAIL'], subject=os.environ['EMAIL_SUBJECT'],
                        html_content=email_response.content)